@@ -1,48 +1,78 @@
 # smartprint/admin.py
 from django.contrib import admin
+from django.db import transaction
 from django.db.models import Sum, F
 from django.utils import timezone
-from .models import PriceSetting, PrintOrder, PrintJob, PredefinedDocument
+from .models import PriceSetting, PrintOrder, PrintJob, PredefinedDocument, get_current_price_setting
+from .tasks import count_pdf_pages
+
+APPROVE_BATCH_SIZE = 500 # Order ids per query in approve_orders
 
 @admin.action(description="Approve selected orders and update totals")
+@transaction.atomic
 def approve_orders(modeladmin, request, queryset):
-    price_settings = PriceSetting.objects.first()
-
-    for order in queryset:
-        if order.status != "APPROVED":  # avoid double-counting
-            order.status = "APPROVED"
-            order.approved_at = timezone.now()
-            order.save()
-
-            total_pages = 0
-            total_cost = 0
-
-            for job in order.items.all():
-                pages_for_job = job.total_pages * job.num_copies
-                total_pages += pages_for_job
-                total_cost += job.item_estimated_cost
-                job.is_printed_by_admin = True
-                job.save()
-
-            # Here, instead of Shop, we update global stats.
-            # You could store in PriceSetting or a separate Stats model.
-            if price_settings:
-                # Example: If you had these fields in PriceSetting
-                if hasattr(price_settings, 'total_earnings'):
-                    price_settings.total_earnings = F('total_earnings') + total_cost
-                if hasattr(price_settings, 'total_pages_printed'):
-                    price_settings.total_pages_printed = F('total_pages_printed') + total_pages
-                price_settings.save()
+    price_settings = get_current_price_setting()
+    now = timezone.now() # One timestamp for the whole batch
+
+    # Plain ids are all that's needed; skip already-approved orders to avoid double-counting.
+    # Rows another admin is approving right now are locked, so skip them rather than wait and re-approve.
+    approved_order_ids = list(
+        queryset.select_for_update(skip_locked=True).exclude(status="APPROVED").values_list('id', flat=True)
+    )
+
+    if not approved_order_ids:
+        return
+
+    total_pages = 0
+    total_cost = 0
+    # Work through the ids in batches so each IN (...) stays under SQLite's bound-parameter limit
+    for start in range(0, len(approved_order_ids), APPROVE_BATCH_SIZE):
+        batch_ids = approved_order_ids[start:start + APPROVE_BATCH_SIZE]
+        totals = PrintJob.objects.filter(order_id__in=batch_ids).aggregate(
+            pages=Sum('pages_total'),
+            cost=Sum('item_estimated_cost'),
+        )
+        total_pages += totals['pages'] or 0
+        total_cost += totals['cost'] or 0
+
+        # Flip the orders and their items with one UPDATE each instead of a save() per row
+        PrintOrder.objects.filter(pk__in=batch_ids).update(status="APPROVED", approved_at=now)
+        PrintJob.objects.filter(order_id__in=batch_ids).update(is_printed_by_admin=True)
+
+    # Here, instead of Shop, we update global stats.
+    # You could store in PriceSetting or a separate Stats model.
+    if price_settings:
+        # Example: If you had these fields in PriceSetting
+        updates = {}
+        if hasattr(price_settings, 'total_earnings'):
+            updates['total_earnings'] = F('total_earnings') + total_cost
+        if hasattr(price_settings, 'total_pages_printed'):
+            updates['total_pages_printed'] = F('total_pages_printed') + total_pages
+        # Narrow, atomic UPDATE of just the counters instead of rewriting the whole row
+        if updates:
+            PriceSetting.objects.filter(pk=price_settings.pk).update(**updates)
 
 @admin.register(PrintOrder)
 class PrintOrderAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "status", "total_estimated_cost", "payment_status", "requested_at")
+    list_select_related = ("user",)
     actions = [approve_orders]
 
 @admin.register(PrintJob)
 class PrintJobAdmin(admin.ModelAdmin):
     list_display = ("id", "order", "total_pages", "num_copies", "is_color", "needs_binding", "item_estimated_cost", "is_printed_by_admin")
     list_filter = ("is_color", "needs_binding", "is_printed_by_admin")
+    list_select_related = ("order", "order__user")  # str(order) renders the user's name
+
+@admin.action(description="Recount pages of selected documents")
+def recount_pages(modeladmin, request, queryset):
+    for pk in queryset.values_list('id', flat=True):
+        count_pdf_pages(pk)
+
+@admin.register(PredefinedDocument)
+class PredefinedDocumentAdmin(admin.ModelAdmin):
+    list_display = ("title", "total_pages", "uploaded_by", "uploaded_at")
+    list_select_related = ("uploaded_by",)
+    actions = [recount_pages]
 
 admin.site.register(PriceSetting)
-admin.site.register(PredefinedDocument)
@@ -1,6 +1,20 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class SmartprintConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'smartprint'
+
+    def ready(self):
+        from . import signals  # noqa: F401 -- registers the signal handlers
+
+        # Report MuPDF's cache limit so per-worker memory use can be reasoned about
+        try:
+            import fitz # PyMuPDF
+        except ImportError:
+            return
+        logger.info("PyMuPDF store_maxsize: %s bytes", fitz.TOOLS.store_maxsize)
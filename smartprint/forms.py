@@ -1,11 +1,30 @@
 # smartprint/forms.py
+from functools import lru_cache
+
 from django import forms
-from django.forms import formset_factory
+from django.forms import BaseFormSet, formset_factory
 from .models import PrintJob, PredefinedDocument
 
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField that resolves the submitted pk from a shared {pk: instance} dict
+    (set on the field as `cache`) before falling back to a query.
+    """
+    cache = None
+
+    def to_python(self, value):
+        if self.cache is not None and value not in self.empty_values:
+            try:
+                return self.cache[int(value)]
+            except (KeyError, TypeError, ValueError):
+                pass # Unknown/invalid pk: let the queryset lookup raise the usual error
+        return super().to_python(value)
+
+
 class PrintJobItemForm(forms.ModelForm):
-    predefined_document = forms.ModelChoiceField(
-        queryset=PredefinedDocument.objects.all(),
+    predefined_document = CachedModelChoiceField(
+        queryset=PredefinedDocument.objects.only('id', 'title').order_by('title'), # Choices only need the label
         required=False,
         empty_label="-- Select a predefined document --",
         label="Select a common document"
@@ -18,6 +37,9 @@ class PrintJobItemForm(forms.ModelForm):
         label='Upload Your Document (PDF/Image)'
     )
 
+    # Signed page count returned by get_page_count_ajax for the uploaded file (filled in by the page's JS)
+    page_count_token = forms.CharField(required=False, widget=forms.HiddenInput())
+
     class Meta:
         model = PrintJob
         fields = [
@@ -48,6 +70,10 @@ class PrintJobItemForm(forms.ModelForm):
             'needs_binding': 'Add Binding',
         }
 
+    def __init__(self, *args, predef_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['predefined_document'].cache = predef_cache
+
     def clean(self):
         cleaned_data = super().clean()
         document = cleaned_data.get('document')
@@ -75,4 +101,26 @@ class PrintJobItemForm(forms.ModelForm):
         return cleaned_data
 
 
-PrintJobItemFormset = formset_factory(PrintJobItemForm, extra=1, can_delete=True)
+class CachedPredefinedFormSet(BaseFormSet):
+    """
+    Loads all PredefinedDocuments once per bound formset and shares them with every form,
+    so validating K items costs one query instead of K.
+    """
+    _predef_cache = None
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        if self.is_bound:
+            if self._predef_cache is None:
+                self._predef_cache = {doc.pk: doc for doc in PredefinedDocument.objects.all()}
+            kwargs['predef_cache'] = self._predef_cache
+        return kwargs
+
+
+@lru_cache(maxsize=None)
+def get_printjob_formset(extra=1):
+    """Builds the PrintJobItemForm formset class once per `extra` value and reuses it afterwards."""
+    return formset_factory(PrintJobItemForm, formset=CachedPredefinedFormSet, extra=extra, can_delete=True)
+
+
+PrintJobItemFormset = get_printjob_formset()
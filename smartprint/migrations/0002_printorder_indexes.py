@@ -0,0 +1,25 @@
+# Generated by Django 4.2.23 on 2026-10-15 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartprint', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='printorder',
+            index=models.Index(fields=['status', '-requested_at'], name='printorder_status_req_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printorder',
+            index=models.Index(fields=['payment_status'], name='printorder_paystatus_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printorder',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['requested_at'], name='printorder_pending_idx'),
+        ),
+    ]
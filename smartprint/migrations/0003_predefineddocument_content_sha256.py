@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-15 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartprint', '0002_printorder_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predefineddocument',
+            name='content_sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.23 on 2026-10-15 09:45
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_pages_total(apps, schema_editor):
+    PrintJob = apps.get_model('smartprint', 'PrintJob')
+    PrintJob.objects.update(pages_total=F('total_pages') * F('num_copies'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartprint', '0003_predefineddocument_content_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='pages_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_pages_total, migrations.RunPython.noop),
+    ]
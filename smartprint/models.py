@@ -1,16 +1,11 @@
 # smartprint/models.py
 
+import hashlib
+import json
+
 from django.db import models
 from django.contrib.auth.models import User
-
-# Import PyMuPDF for PDF page counting in models
-try:
-    import fitz # PyMuPDF
-    from django.core.files.storage import default_storage
-    from django.core.files.base import ContentFile
-except ImportError:
-    fitz = None
-    print("Warning: PyMuPDF (fitz) not installed. PDF page counting in models will not work.")
+from django.core.cache import cache
 
 
 # This model stores the global pricing information, editable by the admin.
@@ -24,6 +19,32 @@ class PriceSetting(models.Model):
     def __str__(self):
         return "Current Price Settings"
 
+    # Prices in integer paise (1 rupee = 100 paise) so cost calculations can stay in plain int math
+    @property
+    def price_per_bw_page_paise(self):
+        return int(round(self.price_per_bw_page * 100))
+
+    @property
+    def price_per_color_page_paise(self):
+        return int(round(self.price_per_color_page * 100))
+
+    @property
+    def binding_cost_paise(self):
+        return int(round(self.binding_cost * 100))
+
+
+PRICE_SETTING_CACHE_KEY = 'smartprint:price_setting' # Cleared by the signal handlers in signals.py
+
+
+def _load_price_setting():
+    # Fall back to a default row so callers always have prices to work with
+    return PriceSetting.objects.first() or PriceSetting.objects.get_or_create(pk=1)[0]
+
+
+def get_current_price_setting():
+    """Returns the active PriceSetting, served from the cache when possible."""
+    return cache.get_or_set(PRICE_SETTING_CACHE_KEY, _load_price_setting, 60 * 60)
+
 
 # This model represents a complete order submitted by a student.
 class PrintOrder(models.Model):
@@ -55,6 +76,15 @@ class PrintOrder(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     admin_notes = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Dashboard / changelist filtering by status, newest first
+            models.Index(fields=['status', '-requested_at'], name='printorder_status_req_idx'),
+            models.Index(fields=['payment_status'], name='printorder_paystatus_idx'),
+            # Most lookups only care about the (small) pending queue
+            models.Index(fields=['requested_at'], name='printorder_pending_idx', condition=models.Q(status='PENDING')),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
 
@@ -65,6 +95,7 @@ class PrintJob(models.Model):
     document = models.FileField(upload_to='print_documents/')
     total_pages = models.IntegerField(default=0)
     num_copies = models.IntegerField(default=1)
+    pages_total = models.IntegerField(default=0, editable=False) # total_pages * num_copies, kept in sync by save()
     
     is_color = models.BooleanField(default=False)
     color_pages_info = models.TextField(blank=True, null=True) 
@@ -77,32 +108,80 @@ class PrintJob(models.Model):
     def __str__(self):
         return f"Item {self.id} for Order {self.order.id}: {self.document.name.split('/')[-1]}"
 
+    def save(self, *args, **kwargs):
+        self.pages_total = self.total_pages * self.num_copies
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'total_pages', 'num_copies'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'pages_total'}
+        super().save(*args, **kwargs)
+
 
 # This model stores common documents that the admin can upload.
 class PredefinedDocument(models.Model):
     title = models.CharField(max_length=255)
     document_file = models.FileField(upload_to='predefined_documents/')
     total_pages = models.IntegerField(default=0) # Field to store page count
+    content_sha256 = models.CharField(max_length=64, db_index=True, blank=True, editable=False) # Used to spot re-uploads of the same file
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    # Name of the file as last loaded from / written to the database (None for new rows)
+    _orig_document_name = None
+
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the stored file name so save() can detect a new upload without re-fetching the row
+        instance = super().from_db(db, field_names, values)
+        if 'document_file' in field_names:
+            instance._orig_document_name = values[field_names.index('document_file')]
+        return instance
+
+    def _hash_document_file(self):
+        """Streams the file through SHA-256 chunk by chunk and rewinds it for saving."""
+        digest = hashlib.sha256()
+        for chunk in self.document_file.chunks():
+            digest.update(chunk)
+        self.document_file.seek(0)
+        return digest.hexdigest()
+
     # Override save method to automatically count pages
     def save(self, *args, **kwargs):
-        if self.document_file and fitz: # Ensure a file is uploaded and PyMuPDF is available
-            # If the file has changed or pages are not set, try to count
-            if not self.pk or self.document_file != PredefinedDocument.objects.get(pk=self.pk).document_file:
-                try:
-                    # Open the file directly from Django's FileField
-                    doc = fitz.open(stream=self.document_file.read(), filetype="pdf") # Use stream for in-memory file
-                    self.total_pages = doc.page_count
-                    doc.close()
-                    # Reset file pointer after reading for Django to save it correctly
-                    self.document_file.seek(0) 
-                except Exception as e:
-                    print(f"Error counting pages for predefined document {self.title}: {e}")
-                    self.total_pages = 0 # Default to 0 if error
+        # Skip the check entirely when document_file was deferred and never touched
+        if 'document_file' not in self.get_deferred_fields() and self.document_file:
+            # Only a newly uploaded file needs hashing / page counting
+            if self.document_file.name != self._orig_document_name:
+                self.content_sha256 = self._hash_document_file()
+                known_pages = PredefinedDocument.objects.filter(
+                    content_sha256=self.content_sha256, total_pages__gt=0
+                ).exclude(pk=self.pk).values_list('total_pages', flat=True).first()
+
+                if known_pages is not None:
+                    # The same bytes were uploaded before; reuse that page count instead of re-parsing
+                    self.total_pages = known_pages
+                else:
+                    from .tasks import fitz, upload_page_count # tasks imports this module
+                    if fitz: # Without PyMuPDF, keep whatever total_pages the admin entered
+                        try:
+                            self.total_pages = upload_page_count(self.document_file.file)
+                        except Exception as e:
+                            print(f"Error counting pages for predefined document {self.title}: {e}")
+                            self.total_pages = 0 # Default to 0 if error
         super().save(*args, **kwargs) # Call the original save method
+        if 'document_file' not in self.get_deferred_fields():
+            self._orig_document_name = self.document_file.name
+
+
+PREDEFINED_PAGES_CACHE_KEY = 'smartprint:predefined_pages_json' # Cleared by the signal handlers in signals.py
+
 
+def get_predefined_pages_json():
+    """Returns the {"<id>": total_pages} map of predefined documents as a JSON string, cached."""
+    pages_json = cache.get(PREDEFINED_PAGES_CACHE_KEY)
+    if pages_json is None:
+        rows = PredefinedDocument.objects.values_list('id', 'total_pages')
+        pages_json = json.dumps({str(doc_id): total_pages for doc_id, total_pages in rows}) # Convert ID to string key
+        cache.set(PREDEFINED_PAGES_CACHE_KEY, pages_json, 60 * 60)
+    return pages_json
@@ -0,0 +1,21 @@
+# smartprint/signals.py
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import PREDEFINED_PAGES_CACHE_KEY, PRICE_SETTING_CACHE_KEY, PredefinedDocument, PriceSetting
+
+
+@receiver([post_save, post_delete], sender=PriceSetting)
+def clear_price_setting_cache(sender, **kwargs):
+    """Drops the cached PriceSetting whenever prices are saved or deleted (admin bulk delete included)."""
+    # Wait for the commit, or a concurrent request could re-cache the old row in between
+    transaction.on_commit(lambda: cache.delete(PRICE_SETTING_CACHE_KEY))
+
+
+@receiver([post_save, post_delete], sender=PredefinedDocument)
+def clear_predefined_pages_cache(sender, **kwargs):
+    """Drops the cached page-count JSON used by user_panel when a predefined document changes."""
+    transaction.on_commit(lambda: cache.delete(PREDEFINED_PAGES_CACHE_KEY)) # See clear_price_setting_cache
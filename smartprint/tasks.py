@@ -0,0 +1,79 @@
+# smartprint/tasks.py
+
+import os
+import tempfile
+
+from django.core.cache import cache
+
+from .models import PREDEFINED_PAGES_CACHE_KEY, PredefinedDocument
+
+# Import PyMuPDF for PDF page counting
+try:
+    import fitz # PyMuPDF
+except ImportError:
+    fitz = None
+    print("Warning: PyMuPDF (fitz) not installed. PDF page counting for predefined documents will not work.")
+
+
+def _page_count_at(*args, **kwargs):
+    """Opens a document with fitz.open(*args, **kwargs) and returns its page count."""
+    doc = None
+    try:
+        doc = fitz.open(*args, **kwargs)
+        return doc.page_count
+    finally:
+        if doc is not None:
+            doc.close()
+        fitz.TOOLS.store_shrink(100) # Empty MuPDF's global object store so worker memory doesn't creep up
+
+
+def upload_page_count(upload):
+    """
+    Returns the page count of a freshly uploaded file and rewinds it so it is saved in full.
+    Large uploads are already spooled to disk, so MuPDF reads those from their temp path.
+    """
+    # Images are accepted too, so let the extension pick MuPDF's document type.
+    # Both branches pass it, so the result doesn't depend on whether the upload was spooled to disk.
+    filetype = os.path.splitext(upload.name or '')[1].lstrip('.').lower() or "pdf"
+    if hasattr(upload, 'temporary_file_path'):
+        page_count = _page_count_at(upload.temporary_file_path(), filetype=filetype)
+    else:
+        upload.seek(0)
+        page_count = _page_count_at(stream=upload.read(), filetype=filetype)
+    upload.seek(0)
+    return page_count
+
+
+def count_pdf_pages(pk):
+    """
+    Recounts the pages of a stored PredefinedDocument and writes the result to its row
+    (used by the admin's "Recount pages" action for rows whose count is missing).
+    Opens the file by path on local storage; for remote storage it is first spooled to a local temp file.
+    """
+    document = PredefinedDocument.objects.filter(pk=pk).only('id', 'document_file').first()
+    if document is None or not document.document_file or not fitz:
+        return
+
+    try:
+        try:
+            page_count = _page_count_at(document.document_file.path)
+        except NotImplementedError: # Storage has no local filesystem path (e.g. S3)
+            # Copy chunk by chunk so large PDFs are never held in memory whole.
+            # Keep the extension so MuPDF still detects the document type from the temp file's name.
+            suffix = os.path.splitext(document.document_file.name)[1] or '.pdf'
+            tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+            try:
+                with tmp:
+                    with document.document_file.open('rb') as f:
+                        for chunk in f.chunks():
+                            tmp.write(chunk)
+                page_count = _page_count_at(tmp.name)
+            finally:
+                os.unlink(tmp.name) # Also removed if reading from remote storage fails mid-copy
+    except Exception as e:
+        print(f"Error counting pages for predefined document {pk}: {e}")
+        return
+
+    PredefinedDocument.objects.filter(pk=pk).update(total_pages=page_count)
+    cache.delete(PREDEFINED_PAGES_CACHE_KEY) # update() doesn't send post_save
+
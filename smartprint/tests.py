@@ -1,3 +1,96 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import PredefinedDocument, PriceSetting, PrintOrder
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UserPanelOrderCostTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        PriceSetting.objects.create(
+            price_per_bw_page=Decimal('1.50'),
+            price_per_color_page=Decimal('5.00'),
+            binding_cost=Decimal('20.00'),
+        )
+        # bulk_create skips PredefinedDocument.save(), so no file has to be parsed
+        PredefinedDocument.objects.bulk_create([
+            PredefinedDocument(title='Syllabus', document_file='predefined_documents/syllabus.pdf', total_pages=10),
+            PredefinedDocument(title='Lab manual', document_file='predefined_documents/manual.pdf', total_pages=0),
+        ])
+        self.counted_doc = PredefinedDocument.objects.get(title='Syllabus')
+        self.uncounted_doc = PredefinedDocument.objects.get(title='Lab manual')
+
+        self.user = User.objects.create_user('student', password='secret')
+        self.client.force_login(self.user)
+
+    def test_submitted_items_are_priced_with_colour_binding_and_copies(self):
+        data = {
+            'items-TOTAL_FORMS': '3',
+            'items-INITIAL_FORMS': '0',
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+            # Colour with binding, 2 copies: (10 * 5.00 + 20.00) * 2 = 140.00
+            'items-0-predefined_document': str(self.counted_doc.pk),
+            'items-0-total_pages': '1',
+            'items-0-num_copies': '2',
+            'items-0-is_color': 'on',
+            'items-0-needs_binding': 'on',
+            # No stored page count, so the typed 4 pages are used: 4 * 1.50 = 6.00
+            'items-1-predefined_document': str(self.uncounted_doc.pk),
+            'items-1-total_pages': '4',
+            'items-1-num_copies': '1',
+            # Unparseable upload falls back to the typed 3 pages: 3 * 1.50 + 20.00 = 24.50
+            'items-2-document': SimpleUploadedFile('notes.pdf', b'not a pdf', content_type='application/pdf'),
+            'items-2-total_pages': '3',
+            'items-2-num_copies': '1',
+            'items-2-needs_binding': 'on',
+        }
+
+        response = self.client.post(reverse('user_panel'), data)
+
+        self.assertRedirects(response, reverse('order_success'), fetch_redirect_response=False)
+        order = PrintOrder.objects.get(user=self.user)
+        items = list(order.items.order_by('id'))
+        self.assertEqual([item.total_pages for item in items], [10, 4, 3])
+        self.assertEqual(
+            [item.item_estimated_cost for item in items],
+            [Decimal('140.00'), Decimal('6.00'), Decimal('24.50')],
+        )
+        self.assertEqual(order.total_estimated_cost, Decimal('170.50'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PredefinedDocumentPageCountTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    @mock.patch('smartprint.tasks.fitz', None)
+    def test_typed_page_count_is_kept_without_pymupdf(self):
+        document = PredefinedDocument(
+            title='Question bank',
+            document_file=SimpleUploadedFile('questions.pdf', b'%PDF-1.4 placeholder', content_type='application/pdf'),
+            total_pages=12,
+        )
+        document.save()
+
+        document.refresh_from_db()
+        self.assertEqual(document.total_pages, 12)
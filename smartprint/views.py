@@ -1,20 +1,25 @@
 # smartprint/views.py
 
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import FileResponse, Http404, JsonResponse
+from django.http import FileResponse, Http404, HttpResponseNotModified, JsonResponse
 from django.contrib.auth.decorators import user_passes_test, login_required
 from django.utils import timezone
-from django.db.models import Sum
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery, Sum
 from django.views.decorators.http import require_POST
-from .models import PrintJob, PriceSetting, PredefinedDocument, PrintOrder, User
-from .forms import PrintJobItemForm, PrintJobItemFormset
-import json # Import json for JSON serialization
+from .models import PrintJob, PrintOrder, get_current_price_setting, get_predefined_pages_json
+from .forms import PrintJobItemFormset
+from .tasks import upload_page_count
+from collections import defaultdict
+from decimal import Decimal
+import hashlib
 
 # Import PyMuPDF for PDF page counting
 try:
     import fitz # PyMuPDF
-    from django.core.files.storage import default_storage
-    from django.core.files.base import ContentFile
 except ImportError:
     fitz = None
     print("Warning: PyMuPDF (fitz) not installed. PDF page counting will not work.")
@@ -27,40 +32,78 @@ def is_admin(user):
 
 
 # Helper function to calculate the cost of a print job item
-def calculate_item_cost(item_data, price_settings):
+def calculate_item_cost_paise(print_job_item, price_settings):
     """
-    Calculates the estimated cost of a single PrintJob item.
-    item_data is a dictionary (from AJAX) or a PrintJob instance (from form submission).
+    Calculates the estimated cost of a single PrintJob instance (from form submission), in integer paise.
+    The AJAX estimate in calculate_cost_ajax applies the same rules to raw POST strings.
     """
-    # Safely get values, converting to int/bool. Use .get() with defaults for dicts.
-    # For PrintJob instances, access attributes directly.
-    num_copies = int(item_data.get('num_copies', 1)) if isinstance(item_data, dict) else int(item_data.num_copies)
-    total_pages = int(item_data.get('total_pages', 0)) if isinstance(item_data, dict) else int(item_data.total_pages)
-    
-    # Checkbox values from JS FormData are 'true' or 'false' strings, convert to Python bool
-    is_color_str = item_data.get('is_color', 'false') if isinstance(item_data, dict) else str(item_data.is_color).lower()
-    is_color = is_color_str == 'true'
-
-    needs_binding_str = item_data.get('needs_binding', 'false') if isinstance(item_data, dict) else str(item_data.needs_binding).lower()
-    needs_binding = needs_binding_str == 'true'
-
     # Ensure numeric types are valid
-    if num_copies < 1: num_copies = 1
-    if total_pages < 0: total_pages = 0
+    num_copies = max(1, print_job_item.num_copies)
+    total_pages = max(0, print_job_item.total_pages)
 
-    cost = 0
-
-    if is_color:
-        cost += (total_pages * price_settings.price_per_color_page)
+    if print_job_item.is_color:
+        cost = total_pages * price_settings.price_per_color_page_paise
     else:
-        cost += (total_pages * price_settings.price_per_bw_page)
+        cost = total_pages * price_settings.price_per_bw_page_paise
 
-    if needs_binding:
-        cost += price_settings.binding_cost
+    if print_job_item.needs_binding:
+        cost += price_settings.binding_cost_paise
 
     return cost * num_copies
 
 
+# Helper function to turn integer paise back into a rupee amount for DecimalFields / display
+def paise_to_rupees(paise):
+    """Converts integer paise to an exact two-place Decimal rupee amount."""
+    return Decimal(paise).scaleb(-2)
+
+
+# Helper function to fingerprint uploaded file contents
+def upload_digest(uploaded_file):
+    """Returns a short BLAKE2b hex digest of the upload, read chunk by chunk, and rewinds it."""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+# Helper function to count the pages of an uploaded PDF, memoized by content
+def pdf_page_count(uploaded_file, digest=None):
+    """
+    Returns the page count of an uploaded PDF and rewinds the file.
+    Counts are cached by a hash of the content, so the same file picked in the
+    browser and then submitted (or uploaded again later) is only parsed once.
+    """
+    key = f"pgcnt:{digest or upload_digest(uploaded_file)}"
+    page_count = cache.get(key)
+    if page_count is None:
+        # Shrinks MuPDF's object store afterwards even if the file fails to parse
+        page_count = upload_page_count(uploaded_file)
+        cache.set(key, page_count, 60 * 60 * 24 * 7)
+    return page_count
+
+
+PAGE_COUNT_TOKEN_SALT = 'smartprint.page_count'
+
+
+# Helper function to trust a page count previously computed by get_page_count_ajax
+def page_count_from_token(token, digest):
+    """
+    Returns the page count carried by a signed token from get_page_count_ajax,
+    or None if the token is missing, tampered with, expired or was issued for different file contents.
+    """
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=PAGE_COUNT_TOKEN_SALT, max_age=60 * 60)
+    except signing.BadSignature:
+        return None
+    if payload.get('digest') != digest:
+        return None
+    return payload.get('pages')
+
+
 # ----------------------------------------------------
 #               User-Facing Views
 # ----------------------------------------------------
@@ -76,65 +119,79 @@ def user_panel(request):
     Displays user's submitted orders.
     """
     # Fetch current price settings (or use defaults if none exist)
-    price_settings, created = PriceSetting.objects.get_or_create(pk=1) # Assuming a single price setting entry
+    price_settings = get_current_price_setting() # Cached; a default entry is created if none exists
 
     if request.method == 'POST':
         formset = PrintJobItemFormset(request.POST, request.FILES, prefix='items') # Use prefix for formset
         
         if formset.is_valid():
-            # Create a new PrintOrder for this submission
-            print_order = PrintOrder.objects.create(user=request.user)
-            total_order_cost = 0
-
-            for form in formset:
-                # Check if the form is marked for deletion (if can_delete=True in formset_factory)
-                if form.cleaned_data.get('DELETE'):
-                    continue # Skip deleted forms
-
-                # Ensure a document or predefined document is selected for non-deleted forms
-                if not form.cleaned_data.get('document') and not form.cleaned_data.get('predefined_document'):
-                    # This case should ideally be caught by form validation
-                    continue # Skip if no document is associated with this form item
-
-                print_job_item = form.save(commit=False)
-                print_job_item.order = print_order # Link item to the new order
-
-                # Handle predefined document vs. uploaded document
-                predefined_doc_obj = form.cleaned_data.get('predefined_document')
-                if predefined_doc_obj:
-                    print_job_item.document = predefined_doc_obj.document_file
-                    print_job_item.total_pages = predefined_doc_obj.total_pages # Get pages from predefined
-                else:
-                    # If a document was uploaded, try to get page count using PyMuPDF
-                    uploaded_file = form.cleaned_data.get('document') # Get uploaded file from cleaned_data
-                    if uploaded_file and fitz:
-                        try:
-                            # Save the uploaded file temporarily to count pages
-                            # This is a more robust way to handle in-memory uploaded files
-                            file_name = default_storage.save(uploaded_file.name, ContentFile(uploaded_file.read()))
-                            temp_path = default_storage.path(file_name)
-
-                            doc = fitz.open(temp_path)
-                            print_job_item.total_pages = doc.page_count
-                            doc.close()
-                            default_storage.delete(file_name) # Clean up temp file
-                        except Exception as e:
-                            print(f"Error counting PDF pages for uploaded file: {e}")
-                            print_job_item.total_pages = 0 # Default to 0 if error
+            # Count the pages of uploaded files up front, before the transaction below is opened,
+            # so a slow PDF parse never holds it open. Identical files in one submission are counted once.
+            upload_page_counts = {} # form prefix -> page count
+            if fitz:
+                counts_by_digest = {}
+                for form in formset:
+                    uploaded_file = form.cleaned_data.get('document')
+                    if form.cleaned_data.get('DELETE') or form.cleaned_data.get('predefined_document') or not uploaded_file:
+                        continue
+                    try:
+                        # Hashing is cheap; the PDF is only parsed if the page-count token doesn't vouch for it.
+                        # Both helpers rewind the file so it is saved in full with the item.
+                        digest = upload_digest(uploaded_file)
+                        if digest not in counts_by_digest:
+                            page_count = page_count_from_token(form.cleaned_data.get('page_count_token'), digest)
+                            if page_count is None:
+                                page_count = pdf_page_count(uploaded_file, digest)
+                            counts_by_digest[digest] = page_count
+                        upload_page_counts[form.prefix] = counts_by_digest[digest]
+                    except Exception as e:
+                        # Leave it out of upload_page_counts so the item falls back to the typed page count
+                        print(f"Error counting PDF pages for uploaded file: {e}")
+
+            with transaction.atomic():
+                # Create a new PrintOrder for this submission
+                print_order = PrintOrder.objects.create(user=request.user)
+                print_job_items = []
+
+                for form in formset:
+                    # Check if the form is marked for deletion (if can_delete=True in formset_factory)
+                    if form.cleaned_data.get('DELETE'):
+                        continue # Skip deleted forms
+
+                    # Ensure a document or predefined document is selected for non-deleted forms
+                    if not form.cleaned_data.get('document') and not form.cleaned_data.get('predefined_document'):
+                        # This case should ideally be caught by form validation
+                        continue # Skip if no document is associated with this form item
+
+                    print_job_item = form.save(commit=False)
+                    print_job_item.order = print_order # Link item to the new order
+
+                    # Handle predefined document vs. uploaded document
+                    predefined_doc_obj = form.cleaned_data.get('predefined_document')
+                    if predefined_doc_obj:
+                        print_job_item.document = predefined_doc_obj.document_file
+                        # Get pages from predefined, or the typed count if it has none recorded yet
+                        print_job_item.total_pages = predefined_doc_obj.total_pages or form.cleaned_data.get('total_pages', 0)
                     else:
-                        # If no file or fitz not available, use total_pages from form input
-                        print_job_item.total_pages = form.cleaned_data.get('total_pages', 0)
-
-
-                # Calculate estimated cost for this item
-                # Pass cleaned_data dict to calculate_item_cost for consistency
-                print_job_item.item_estimated_cost = calculate_item_cost(form.cleaned_data, price_settings)
-                print_job_item.save() # Save the PrintJob instance
-                total_order_cost += print_job_item.item_estimated_cost
-
-            # Update total cost of the PrintOrder
-            print_order.total_estimated_cost = total_order_cost
-            print_order.save()
+                        # If a document was uploaded, use the page count worked out above with PyMuPDF
+                        if form.prefix in upload_page_counts:
+                            print_job_item.total_pages = upload_page_counts[form.prefix]
+                        else:
+                            # If no file or fitz not available, use total_pages from form input
+                            print_job_item.total_pages = form.cleaned_data.get('total_pages', 0)
+
+                    # Calculate estimated cost for this item from its final page count and options
+                    print_job_item.item_estimated_cost = paise_to_rupees(calculate_item_cost_paise(print_job_item, price_settings))
+                    # bulk_create() skips PrintJob.save(), so fill the denormalized page total here
+                    print_job_item.pages_total = print_job_item.total_pages * print_job_item.num_copies
+                    print_job_items.append(print_job_item)
+
+                # Insert all items in one query (uploaded files are still written by FileField.pre_save)
+                PrintJob.objects.bulk_create(print_job_items)
+
+                # Update total cost of the PrintOrder
+                print_order.total_estimated_cost = sum(item.item_estimated_cost for item in print_job_items)
+                print_order.save(update_fields=['total_estimated_cost'])
 
             # Redirect to the success page after submission
             return redirect('order_success') 
@@ -143,18 +200,27 @@ def user_panel(request):
     else:
         formset = PrintJobItemFormset(prefix='items') # Create an empty formset for GET requests
 
-    predefined_docs = PredefinedDocument.objects.all()
     # Ensure predefined_doc_pages is always a dictionary, even if no predefined docs exist
-    # Convert QuerySet to a dict and then to JSON string
-    predefined_doc_pages_map = {str(doc.id): doc.total_pages for doc in predefined_docs} # Convert ID to string key
-    predefined_doc_pages_json = json.dumps(predefined_doc_pages_map)
+    # The JSON string is cached and rebuilt only after a predefined document changes
+    predefined_doc_pages_json = get_predefined_pages_json()
     
-    # Fetch current user's print orders for display
-    user_print_orders = PrintOrder.objects.filter(user=request.user).order_by('-requested_at')
+    # Fetch current user's print orders for display, limited to the columns the table shows,
+    # with their items prefetched in one query instead of one per order
+    user_order_items = PrintJob.objects.only(
+        'id', 'order', 'document', 'total_pages', 'num_copies', 'is_color',
+        'color_pages_info', 'needs_binding', 'item_estimated_cost',
+    )
+    user_orders_qs = (
+        PrintOrder.objects.filter(user=request.user)
+        .only('id', 'status', 'requested_at', 'total_estimated_cost', 'payment_status')
+        .order_by('-requested_at')
+        .prefetch_related(Prefetch('items', queryset=user_order_items))
+    )
+    # Show one page of history at a time; items are only prefetched for the orders on that page
+    user_print_orders = Paginator(user_orders_qs, 20).get_page(request.GET.get('page'))
 
     context = {
         'formset': formset, # Pass the formset to the template
-        'predefined_docs': predefined_docs,
         'predefined_doc_pages': predefined_doc_pages_json, # Pass the JSON string here
         'user': request.user,
         'user_print_orders': user_print_orders,
@@ -174,33 +240,57 @@ def calculate_cost_ajax(request):
     """
     try:
         # Get price settings
-        price_settings = PriceSetting.objects.first()
+        price_settings = get_current_price_setting()
         if not price_settings:
             return JsonResponse({'error': 'Price settings not found. Please configure in admin.'}, status=500)
 
+        # Snapshot the prices once, in integer paise; the loop below only does int math on locals
+        price_per_color_page = price_settings.price_per_color_page_paise
+        price_per_bw_page = price_settings.price_per_bw_page_paise
+        binding_cost = price_settings.binding_cost_paise
+        post = request.POST
+
         total_order_cost = 0
-        
+
         # Determine the number of forms submitted via AJAX
         # Use TOTAL_FORMS from the formset management data
-        total_forms = int(request.POST.get('items-TOTAL_FORMS', 0))
-
-        for i in range(total_forms):
+        total_forms = int(post.get('items-TOTAL_FORMS', 0))
+
+        # Build each item's POST keys once; both the fingerprint and the cost loop below read them
+        item_keys = [
+            (f'items-{i}-DELETE', f'items-{i}-num_copies', f'items-{i}-total_pages',
+             f'items-{i}-is_color', f'items-{i}-needs_binding')
+            for i in range(total_forms)
+        ]
+
+        # Fingerprint only the inputs that affect the price, plus the prices themselves.
+        # (request.body can't be used: it's multipart with a fresh boundary on every call.)
+        pricing_state = [str(price_settings.pk), price_settings.last_updated.isoformat(), str(total_forms)]
+        for keys in item_keys:
+            pricing_state.extend(post.get(key, '') for key in keys)
+        etag = '"%s"' % hashlib.blake2b('\x1f'.join(pricing_state).encode(), digest_size=16).hexdigest()
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponseNotModified() # Client already shows the cost for this exact state
+
+        for delete_key, copies_key, pages_key, color_key, binding_key in item_keys:
             # Check if this specific form is marked for deletion in AJAX (if frontend sends it)
-            if request.POST.get(f'items-{i}-DELETE') == 'true':
+            if post.get(delete_key) == 'true':
                 continue # Skip deleted forms
 
-            # Extract data for each item, providing default values for numbers
-            item_data_for_calc = {
-                'num_copies': request.POST.get(f'items-{i}-num_copies') or '1', # Default to '1' string
-                'total_pages': request.POST.get(f'items-{i}-total_pages') or '0', # Default to '0' string
-                'is_color': request.POST.get(f'items-{i}-is_color') or 'false', # Default to 'false' string
-                'needs_binding': request.POST.get(f'items-{i}-needs_binding') or 'false', # Default to 'false' string
-            }
-            
-            # Calculate cost for this item and add to total order cost
-            total_order_cost += calculate_item_cost(item_data_for_calc, price_settings)
+            # Same rules as calculate_item_cost_paise: at least one copy, never negative pages
+            num_copies = max(1, int(post.get(copies_key) or 1))
+            total_pages = max(0, int(post.get(pages_key) or 0))
+
+            per_page = price_per_color_page if post.get(color_key) == 'true' else price_per_bw_page
+            cost = total_pages * per_page
+            if post.get(binding_key) == 'true':
+                cost += binding_cost
 
-        return JsonResponse({'estimated_cost': f'₹ {total_order_cost:.2f}'})
+            total_order_cost += cost * num_copies
+
+        response = JsonResponse({'estimated_cost': f'₹ {paise_to_rupees(total_order_cost):.2f}'})
+        response['ETag'] = etag
+        return response
 
     except Exception as e:
         # Catch any unexpected errors and return a JSON error response
@@ -222,16 +312,13 @@ def get_page_count_ajax(request):
         return JsonResponse({'error': 'PyMuPDF not installed on server.'}, status=500)
 
     try:
-        # Save the uploaded file temporarily to count pages
-        file_name = default_storage.save(uploaded_file.name, ContentFile(uploaded_file.read()))
-        temp_path = default_storage.path(file_name)
-
-        doc = fitz.open(temp_path)
-        page_count = doc.page_count
-        doc.close()
-        default_storage.delete(file_name) # Clean up temp file
+        # Count pages straight from the upload; nothing is written to storage
+        digest = upload_digest(uploaded_file)
+        page_count = pdf_page_count(uploaded_file, digest)
 
-        return JsonResponse({'total_pages': page_count})
+        # Signed receipt for this count, so user_panel can skip re-parsing the same file on submit
+        token = signing.dumps({'digest': digest, 'pages': page_count}, salt=PAGE_COUNT_TOKEN_SALT)
+        return JsonResponse({'total_pages': page_count, 'page_count_token': token})
 
     except Exception as e:
         print(f"Error processing PDF for page count: {e}")
@@ -249,22 +336,39 @@ def admin_dashboard(request):
     Displays pending orders and basic analytics.
     """
     # Fetch all pending orders, ordered from oldest to newest
-    # Use select_related to fetch user to avoid N+1 queries
-    pending_orders = PrintOrder.objects.filter(status='PENDING').order_by('requested_at').select_related('user')
+    # Plain dicts via values() are enough to render the list and skip model instantiation per row
+    pending_orders = list(
+        PrintOrder.objects.filter(status='PENDING')
+        .order_by('requested_at')
+        .values('id', 'status', 'requested_at', 'total_estimated_cost', 'payment_status', 'user__username')
+    )
+
+    # Fetch every pending order's items in one query and group them per order to avoid N+1 queries
+    items_by_order = defaultdict(list)
+    pending_items = PrintJob.objects.filter(order_id__in=[order['id'] for order in pending_orders]).order_by('id').values(
+        'id', 'order_id', 'document', 'total_pages', 'num_copies', 'is_color',
+        'color_pages_info', 'needs_binding', 'item_estimated_cost', 'is_printed_by_admin',
+    )
+    for item in pending_items:
+        items_by_order[item['order_id']].append(item)
+    for order in pending_orders:
+        order['items'] = items_by_order[order['id']]
 
     # Basic Data Analysis for the dashboard (based on PrintOrder)
     # Filter by requested_at for PrintOrder
-    total_jobs_today = PrintOrder.objects.filter(requested_at__date=timezone.now().date()).count()
-
-    total_earnings_today = PrintOrder.objects.filter(
-        requested_at__date=timezone.now().date(),
-        payment_status__in=['FULL_PAID', 'ADVANCE_PAID']
-    ).aggregate(total=Sum('total_estimated_cost'))['total'] or 0
+    # Order count and paid earnings come from the same rows, so fetch both in one query
+    today = timezone.now().date()
+    today_stats = PrintOrder.objects.filter(requested_at__date=today).aggregate(
+        jobs=Count('id'),
+        earnings=Sum('total_estimated_cost', filter=Q(payment_status__in=['FULL_PAID', 'ADVANCE_PAID'])),
+    )
+    total_jobs_today = today_stats['jobs']
+    total_earnings_today = today_stats['earnings'] or 0
 
     # Calculate total pages printed today for COMPLETED items within COMPLETED orders
     # This requires summing across related PrintJob items
     total_pages_printed_today = PrintOrder.objects.filter(
-        completed_at__date=timezone.now().date(),
+        completed_at__date=today,
         status='COMPLETED'
     ).aggregate(total=Sum('items__total_pages'))['total'] or 0 # Sum total_pages from related PrintJob items
     
@@ -282,14 +386,21 @@ def admin_profile(request):
     Renders the admin profile and analytics page.
     Displays earnings and other detailed statistics.
     """
-    # Fetch data for analytics here
-    total_earnings_all_time = PrintOrder.objects.filter(
-        payment_status__in=['FULL_PAID', 'ADVANCE_PAID']
-    ).aggregate(total=Sum('total_estimated_cost'))['total'] or 0
-
-    total_pages_all_time = PrintOrder.objects.filter(
-        status='COMPLETED'
-    ).aggregate(total=Sum('items__total_pages'))['total'] or 0
+    # Fetch data for analytics here, in a single query.
+    # Pages are summed per order in a subquery: joining items directly would repeat each
+    # order's total_estimated_cost once per item and inflate the earnings sum.
+    order_pages = (
+        PrintJob.objects.filter(order=OuterRef('pk'))
+        .values('order')
+        .annotate(total=Sum('total_pages'))
+        .values('total')
+    )
+    stats = PrintOrder.objects.annotate(order_pages=Subquery(order_pages)).aggregate(
+        earnings=Sum('total_estimated_cost', filter=Q(payment_status__in=['FULL_PAID', 'ADVANCE_PAID'])),
+        pages=Sum('order_pages', filter=Q(status='COMPLETED')),
+    )
+    total_earnings_all_time = stats['earnings'] or 0
+    total_pages_all_time = stats['pages'] or 0
     
     # You can add more detailed analytics here, e.g.,
     # orders_by_status = PrintOrder.objects.values('status').annotate(count=Count('id'))
@@ -307,35 +418,32 @@ def admin_profile(request):
 @user_passes_test(is_admin)
 def approve_order(request, order_id): # Changed to approve_order
     """Updates an order's status to 'APPROVED'."""
-    order = get_object_or_404(PrintOrder, pk=order_id)
-    order.status = 'APPROVED'
-    order.approved_at = timezone.now()
-    order.save()
+    # Single UPDATE of just the changed columns instead of fetching and re-saving the row
+    if not PrintOrder.objects.filter(pk=order_id).update(status='APPROVED', approved_at=timezone.now()):
+        raise Http404("Order not found.")
     return redirect('admin_dashboard')
 
 @user_passes_test(is_admin)
 def reject_order(request, order_id): # Changed to reject_order
     """Updates an order's status to 'REJECTED'."""
-    order = get_object_or_404(PrintOrder, pk=order_id)
-    order.status = 'REJECTED'
-    order.save()
+    if not PrintOrder.objects.filter(pk=order_id).update(status='REJECTED'):
+        raise Http404("Order not found.")
     return redirect('admin_dashboard')
 
 @user_passes_test(is_admin)
 def complete_order(request, order_id):
     """Updates an order's status to 'COMPLETED'."""
-    order = get_object_or_404(PrintOrder, pk=order_id)
-    order.status = 'COMPLETED'
-    order.completed_at = timezone.now() # Set completion timestamp
-    order.save()
+    # Set completion timestamp alongside the status
+    if not PrintOrder.objects.filter(pk=order_id).update(status='COMPLETED', completed_at=timezone.now()):
+        raise Http404("Order not found.")
     return redirect('admin_dashboard')
 
 @user_passes_test(is_admin)
 def mark_as_paid_order(request, order_id):
     """Updates an order's payment_status to 'FULL_PAID'."""
-    order = get_object_or_404(PrintOrder, pk=order_id)
-    order.payment_status = 'FULL_PAID' # Or 'ADVANCE_PAID' if you want to differentiate
-    order.save()
+    # Or 'ADVANCE_PAID' if you want to differentiate
+    if not PrintOrder.objects.filter(pk=order_id).update(payment_status='FULL_PAID'):
+        raise Http404("Order not found.")
     return redirect('admin_dashboard')
 
 @user_passes_test(is_admin)